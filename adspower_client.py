@@ -1,18 +1,49 @@
 import time
+import queue
+import random
 import requests
 import logging
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
 from selenium import webdriver
 from selenium.webdriver.chrome.service import Service
-from settings import ADSPOWER_BASE_URL  # Import the base URL for AdsPower API from settings
+from selenium.webdriver.support.ui import WebDriverWait
+from selenium.common.exceptions import TimeoutException
+from settings import ADSPOWER_BASE_URL, ADSPOWER_HEADLESS, DEFAULT_USER_AGENT, PROFILES_TO_PROXIES
 
 # Set up logging
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
 
+# Markers of a bot challenge page, which needs a real browser to solve
+CHALLENGE_MARKERS = ("captcha", "Access Denied", "Pardon Our Interruption")
+
+# Seconds to wait for the StubHub homepage when getting cookies without a browser
+HTTP_COOKIES_TIMEOUT = 30
+
+# Seconds the browser waits for the StubHub session cookie. A loaded page without it is
+# only accepted after the grace period, so cookies set by scripts have time to appear.
+BROWSER_COOKIES_TIMEOUT = 15
+BROWSER_COOKIES_GRACE = 10
+
 
 class AdsPowerManager:
     def __init__(self):
         # Initialize with the base URL for AdsPower API
         self.base_url = ADSPOWER_BASE_URL
+        # Reuse one connection to the local AdsPower API per thread, as requests.Session
+        # is not thread-safe and the manager is shared by the cookie pool threads
+        self._local = threading.local()
+        # Running chromedriver services by webdriver path, shared by all browser launches
+        self._service_cache = {}
+        self._service_lock = threading.Lock()
+
+    @property
+    def session(self):
+        """requests.Session of the calling thread, created on first use."""
+        if not hasattr(self._local, "session"):
+            self._local.session = requests.Session()
+        return self._local.session
 
     def get_ws_endpoint(self, profile_id):
         """
@@ -25,8 +56,8 @@ class AdsPowerManager:
             tuple: WebSocket endpoint and webdriver path.
         """
         # Construct the URL for the API request to start the browser for the given profile
-        url = f"{self.base_url}/api/v1/browser/start?user_id={profile_id}&ip_tab=0&open_tabs=1&clear_cache_after_closing=1&launch_args=[%22-no-sandbox%22]"
-        response = requests.get(url=url)
+        url = f"{self.base_url}/api/v1/browser/start?user_id={profile_id}&ip_tab=0&open_tabs=1&clear_cache_after_closing=1&launch_args=[%22-no-sandbox%22]&headless={int(ADSPOWER_HEADLESS)}"
+        response = self.session.get(url=url)
 
         # Raise an exception for failed requests (non-2xx status codes)
         response.raise_for_status()
@@ -47,7 +78,7 @@ class AdsPowerManager:
         """
         # Construct the URL for the API request to stop the browser for the given profile
         url = f"{self.base_url}/api/v1/browser/stop?user_id={profile_id}"
-        response = requests.get(url)
+        response = self.session.get(url)
 
         # Log the status of the browser closing operation
         logging.info(f"AdsPower Browser Close: {response.status_code}")
@@ -55,9 +86,95 @@ class AdsPowerManager:
         # Raise an exception for failed requests (non-2xx status codes)
         response.raise_for_status()
 
-    def get_cookies(self, profile_id):
+    def get_service(self, webdriver_path):
+        """
+        Get a running chromedriver service for the given webdriver path, starting it only
+        the first time it is needed.
+
+        Args:
+            webdriver_path (str): Path of the chromedriver executable.
+
+        Returns:
+            Service: Running chromedriver service.
+        """
+        with self._service_lock:
+            if webdriver_path not in self._service_cache:
+                self._service_cache[webdriver_path] = Service(executable_path=webdriver_path)
+            service = self._service_cache[webdriver_path]
+            if not service.is_connectable():
+                service.start()
+        return service
+
+    def close(self):
+        """Stop the cached chromedriver services."""
+        with self._service_lock:
+            for service in self._service_cache.values():
+                service.stop()
+            self._service_cache.clear()
+
+    def get_cookies(self, profile_id, force_browser=False):
+        """
+        Get cookies and user agent for a given profile. Cookies are first requested over
+        plain HTTP through the profile proxy, the browser is only launched if StubHub
+        answers with a challenge.
+
+        Args:
+            profile_id (str): The ID of the profile to get cookies for.
+            force_browser (bool): Skip the plain HTTP attempt, e.g. because cookies got
+             that way were rejected by StubHub.
+
+        Returns:
+            tuple: Cookie string and user agent.
+        """
+        if not force_browser:
+            http_cookies = self.get_http_cookies(profile_id)
+            if http_cookies:
+                return http_cookies
+
+        logging.info("Falling back to the AdsPower browser to get cookies")
+        return self.get_browser_cookies(profile_id)
+
+    def get_http_cookies(self, profile_id):
+        """
+        Get cookies for a given profile by requesting the StubHub homepage without a browser.
+
+        Args:
+            profile_id (str): The ID of the profile whose proxy is used.
+
+        Returns:
+            tuple: Cookie string and user agent, or None if StubHub answered with a challenge.
+        """
+        proxy = PROFILES_TO_PROXIES[profile_id]['proxy']
+        session = requests.Session()
+        session.proxies = {
+            "http": proxy,
+            "https": proxy
+        }
+
+        try:
+            response = session.get(
+                "https://www.stubhub.com/",
+                headers={"User-Agent": DEFAULT_USER_AGENT},
+                timeout=HTTP_COOKIES_TIMEOUT
+            )
+        except requests.RequestException as e:
+            logging.warning(f"Getting cookies over HTTP failed: {e}")
+            return None
+        finally:
+            session.close()
+
+        # A challenge page has to be solved by a browser
+        if response.status_code != 200 or not session.cookies or any(
+                marker in response.text for marker in CHALLENGE_MARKERS):
+            logging.info(f"StubHub answered with a challenge, Status Code: {response.status_code}")
+            return None
+
+        cookie_string = "; ".join([f"{cookie.name}={cookie.value}" for cookie in session.cookies])
+        return cookie_string, DEFAULT_USER_AGENT
+
+    def get_browser_cookies(self, profile_id):
         """
-        Get cookies and user agent for a given profile.
+        Get cookies and user agent for a given profile from its AdsPower browser.
 
         Args:
             profile_id (str): The ID of the profile to get cookies for.
@@ -68,23 +185,31 @@ class AdsPowerManager:
         # Fetch the WebSocket endpoint and webdriver path for the profile
         ws_endpoint, webdriver_path = self.get_ws_endpoint(profile_id)
 
-        # Set up the Selenium WebDriver to use the WebSocket endpoint and webdriver path
-        service = Service(executable_path=webdriver_path)
+        # Set up the Selenium WebDriver to use the WebSocket endpoint, attached to a
+        # chromedriver which keeps running between calls
+        service = self.get_service(webdriver_path)
         options = webdriver.ChromeOptions()
         options.add_experimental_option("debuggerAddress", ws_endpoint)
 
-        driver = webdriver.Chrome(service=service, options=options)
+        driver = webdriver.Remote(command_executor=service.service_url, options=options)
 
         # Log the start of the cookie retrieval process
         logging.info("Start Getting Cookies")
 
         try:
-            # Open StubHub and wait for the page to load
+            # Open StubHub and wait until the session cookie is set. driver.get() already
+            # waits for the page load, so a loaded page without the cookie is only accepted
+            # once the grace period for cookies set by scripts has passed.
             driver.get("https://www.stubhub.com/")
-
-            # worst case, if the proxies are slow. We can replace with any element to load,
-            # if we do not need to hardcode the wait time.
-            time.sleep(10)
+            grace_deadline = time.monotonic() + BROWSER_COOKIES_GRACE
+            try:
+                WebDriverWait(driver, BROWSER_COOKIES_TIMEOUT).until(
+                    lambda d: any(cookie['name'] == 'STUB_SESSION' for cookie in d.get_cookies())
+                    or (time.monotonic() >= grace_deadline
+                        and d.execute_script("return document.readyState") == "complete")
+                )
+            except TimeoutException:
+                logging.warning("StubHub did not finish loading in time, using the cookies set so far")
 
             # Get the cookies from the browser and convert them into a string
             cookies = driver.get_cookies()
@@ -100,3 +225,106 @@ class AdsPowerManager:
         self.close_browser(profile_id)
 
         return cookie_string, user_agent
+
+
+class CookiePool:
+    """
+    Harvests cookies of AdsPower profiles in background threads, so fresh cookies are
+    usually ready before the scraper needs them instead of waiting for a browser to start.
+    """
+
+    def __init__(self, profile_ids, max_workers=None):
+        """
+        Initialize the pool.
+
+        Args:
+            profile_ids (list): IDs of the AdsPower profiles to harvest cookies from.
+            max_workers (int): Number of browsers warmed at the same time. Defaults to one per profile.
+        """
+        self.profile_ids = list(profile_ids)
+        self.ads_power_client = AdsPowerManager()
+        self.executor = ThreadPoolExecutor(max_workers=max_workers or len(self.profile_ids))
+        self.queue = queue.Queue()
+
+        # Profiles with a harvest in progress, so the same browser is not started twice
+        self._pending = set()
+        # Profiles whose plain HTTP cookies were rejected, always harvested with the browser
+        self._browser_only = set()
+        self._lock = threading.Lock()
+
+        # Set on shutdown, so failed harvests stop being retried
+        self._stopped = threading.Event()
+
+    def start(self):
+        """Start harvesting cookies for every profile."""
+        for profile_id in self.profile_ids:
+            self.refresh(profile_id)
+
+    def refresh(self, profile_id, force_browser=False):
+        """
+        Harvest new cookies for a profile in the background.
+
+        Args:
+            profile_id (str): The ID of the profile to harvest cookies for.
+            force_browser (bool): Harvest with the AdsPower browser, skipping plain HTTP.
+             Remembered for all later harvests of the profile.
+        """
+        with self._lock:
+            if force_browser:
+                self._browser_only.add(profile_id)
+            force_browser = profile_id in self._browser_only
+            if profile_id in self._pending:
+                return
+            self._pending.add(profile_id)
+        self.executor.submit(self._warm, profile_id, force_browser)
+
+    def _warm(self, profile_id, force_browser=False):
+        """
+        Harvest cookies for a profile and put them on the queue. Failed harvests are
+        retried with an exponential backoff until they succeed or the pool is shut down.
+
+        Args:
+            profile_id (str): The ID of the profile to harvest cookies for.
+            force_browser (bool): Harvest with the AdsPower browser, skipping plain HTTP.
+        """
+        attempt = 0
+        try:
+            while not self._stopped.is_set():
+                attempt += 1
+                try:
+                    cookies, user_agent = self.ads_power_client.get_cookies(profile_id, force_browser)
+                    self.queue.put((profile_id, cookies, user_agent, time.monotonic()))
+                    return
+                except Exception as e:
+                    logging.error(f"Attempt {attempt} to get cookies for profile {profile_id} failed: {e}")
+                    logging.debug(traceback.format_exc())
+
+                backoff = min(2 ** attempt, 60) + random.random()
+                logging.warning(f"Retrying to get cookies for profile {profile_id} after {backoff:.1f} seconds...")
+                self._stopped.wait(backoff)
+        finally:
+            with self._lock:
+                self._pending.discard(profile_id)
+
+    def get(self, block=True, timeout=300):
+        """
+        Take the next harvested cookies, waiting for a harvest to finish if none are ready.
+
+        Args:
+            block (bool): Wait for a harvest if no cookies are ready.
+            timeout (float): Maximum number of seconds to wait.
+
+        Returns:
+            tuple: Profile ID, cookie string, user agent and time.monotonic() timestamp of the harvest.
+
+        Raises:
+            queue.Empty: If no cookies were harvested within the timeout, or none are ready
+             when not blocking.
+        """
+        return self.queue.get(block=block, timeout=timeout)
+
+    def shutdown(self):
+        """Stop the background harvesting and the chromedriver services."""
+        self._stopped.set()
+        self.executor.shutdown(wait=True, cancel_futures=True)
+        self.ads_power_client.close()
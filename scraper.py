@@ -1,70 +1,263 @@
+import os
 import re
-import json
+import csv
+import time
+import orjson
 import base64
-import pandas as pd
+import math
+import asyncio
+import functools
+import queue
+import itertools
 import random
 import logging
 import traceback
 
 from collections import defaultdict
-from curl_cffi import requests
+from curl_cffi import CurlHttpVersion
+from curl_cffi.requests import AsyncSession
 
-from settings import PROFILES_TO_PROXIES, RETRY_ATTEMPTS
-from adspower_client import AdsPowerManager
+from settings import PROFILES_TO_PROXIES, RETRY_ATTEMPTS, CONCURRENT_REQUESTS, COOKIE_TTL
+from adspower_client import CookiePool
 
 # Set up logging configuration
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
 
 
+class ScrapeFailed(Exception):
+    """Raised when a StubHub page could not be fetched within the retry attempts."""
+
+
 class StubhubScraper:
     """
     A scraper class to fetch event URLs and ticket listings from StubHub using rotating
      proxies and session management.
     """
 
-    def __init__(self):
+    def __init__(self, cookie_pool=None, concurrent_requests=CONCURRENT_REQUESTS):
         """
-        Initialize the StubhubScraper with the given profile ID.
+        Initialize the StubhubScraper.
 
         Args:
-            profile_id (str): Profile ID to fetch proxy, rotation details and
-             a reference to ads power profile.
+            cookie_pool (CookiePool): Pool harvesting cookies of the AdsPower profiles. A pool
+             for all profiles in settings is started if not given.
+            concurrent_requests (int): Maximum number of requests sent to StubHub at the same time.
         """
-        self.cookies = None
-        self.user_agent = None
-        self.profile_id = None
-        self.proxy = None
-        self.rotation_link = None
+        if cookie_pool is None:
+            cookie_pool = CookiePool(PROFILES_TO_PROXIES.keys())
+            cookie_pool.start()
+        self.cookie_pool = cookie_pool
+
+        # One session per profile keeps the connection through its proxy alive across page
+        # requests, so we pay the TCP/TLS handshake only once per proxy. With HTTP/2 the
+        # concurrent requests are multiplexed over that connection instead of queueing.
+        self.sessions = {}
+        for profile_id, profile in PROFILES_TO_PROXIES.items():
+            self.sessions[profile_id] = AsyncSession(
+                proxies={
+                    "http": profile['proxy'],
+                    "https": profile['proxy']
+                },
+                http_version=CurlHttpVersion.V2TLS,
+                max_clients=concurrent_requests
+            )
+
+        # Requests are spread round-robin over the profiles which have usable cookies
+        self._profile_cycle = itertools.cycle(PROFILES_TO_PROXIES)
+
+        # Usable cookies by profile ID, as tuples of cookie string, user agent and harvest time
+        self._cookie_cache = {}
+        # Profiles whose cookies passed COOKIE_TTL and are being harvested again
+        self._renewing = set()
+
+        # Limit the number of in-flight requests to StubHub
+        self.semaphore = asyncio.Semaphore(concurrent_requests)
+
+        # Serialize cookie refreshes, so a burst of failed requests waits for a single harvest
+        self._cookie_lock = asyncio.Lock()
+
+        # Static request headers and listing payload, built once instead of on every page.
+        # Cookies and user-agent are set on the profile sessions.
+        self._explore_headers = {
+            'accept': '*/*',
+            'accept-language': 'en-US,en;q=0.9',
+            'content-type': 'application/json'
+        }
+        self._listing_headers = {
+            'accept': '*/*',
+            'accept-language': 'en-GB,en-US;q=0.9,en;q=0.8',
+            'cache-control': 'no-cache',
+            'content-type': 'application/json',
+            'origin': 'https://www.stubhub.com',
+            'pragma': 'no-cache',
+            'priority': 'u=1, i',
+            'sec-ch-ua': '"Google Chrome";v="131", "Chromium";v="131", "Not_A Brand";v="24"',
+            'sec-ch-ua-mobile': '?0',
+            'sec-ch-ua-platform': '"Windows"',
+            'sec-fetch-dest': 'empty',
+            'sec-fetch-mode': 'cors',
+            'sec-fetch-site': 'same-origin',
+        }
+        self._listing_payload = {
+            'ShowAllTickets': True,
+            'HideDuplicateTicketsV2': False,
+            'Quantity': 2,
+            'IsInitialQuantityChange': False,
+            'PageVisitId': '8B9A160A-F8B7-4256-9412-827CB48FD137',
+            'PageSize': 20,
+            'SortBy': 'NEWPRICE',
+            'SortDirection': 0,
+            'Sections': '',
+            'Rows': '',
+            'Seats': '',
+            'SeatTypes': '',
+            'TicketClasses': '',
+            'ListingNotes': '',
+            'PriceRange': '0,100',
+            'InstantDelivery': False,
+            'EstimatedFees': False,
+            'BetterValueTickets': True,
+            'PriceOption': '',
+            'HasFlexiblePricing': False,
+            'ExcludeSoldListings': False,
+            'RemoveObstructedView': False,
+            'NewListingsOnly': False,
+            'PriceDropListingsOnly': False,
+            'SelectBestListing': False,
+            'ConciergeTickets': False,
+            'Favorites': False,
+            'Method': 'IndexSh',
+        }
 
-    def update_with_random_profile(self):
-        """
-        Select a random profile from available profiles and update the proxy details.
+    @staticmethod
+    def rotate_proxy(profile_id):
         """
-        profile_id = random.choice(list(PROFILES_TO_PROXIES.keys()))
-        self.profile_id = profile_id
-        self.proxy = PROFILES_TO_PROXIES[profile_id]['proxy']
-        self.rotation_link = PROFILES_TO_PROXIES[profile_id].get('rotation_url')
+        Rotates the proxy of the given profile.
 
-    def rotate_proxy(self):
-        """Rotates the proxy"""
+        Args:
+            profile_id (str): Profile ID whose proxy should be rotated.
+        """
         import requests
 
-        if self.rotation_link:
-            response = requests.get(self.rotation_link)
+        rotation_link = PROFILES_TO_PROXIES[profile_id].get('rotation_url')
+        if rotation_link:
+            response = requests.get(rotation_link)
             return response.status_code == 200
 
-    def update_cookies(self):
+    def _apply_cookies(self, profile_id, cookies, user_agent, harvested_at):
+        """
+        Set cookies and user-agent on the session of a profile and put it back in rotation.
+
+        Args:
+            profile_id (str): Profile ID the cookies were harvested with.
+            cookies (str): Cookie string.
+            user_agent (str): User agent of the browser the cookies were harvested with.
+            harvested_at (float): time.monotonic() timestamp of the harvest.
+        """
+        # Cookies go into the session jar, which serializes them into the Cookie header
+        session = self.sessions[profile_id]
+        session.cookies.clear()
+        for cookie in cookies.split("; "):
+            if "=" in cookie:
+                name, value = cookie.split("=", 1)
+                session.cookies.set(name, value, domain=".stubhub.com")
+        session.headers.update({'user-agent': user_agent})
+        self._cookie_cache[profile_id] = (cookies, user_agent, harvested_at)
+        self._renewing.discard(profile_id)
+
+    async def refresh_cookies(self, timeout=300):
+        """
+        Apply the cookies and user-agents harvested by the cookie pool to the sessions
+        of their profiles. Waits for a harvest only if no profile has usable cookies.
+
+        Args:
+            timeout (float): Maximum number of seconds to wait for a harvest.
+
+        Raises:
+            queue.Empty: If no profile has usable cookies and none were harvested within the timeout.
+        """
+        async with self._cookie_lock:
+            # Poll the pool instead of blocking in a worker thread, so a cancelled request
+            # cannot leave a thread behind which takes a harvest off the queue and drops it
+            deadline = time.monotonic() + timeout
+            while True:
+                self._take_harvested_cookies()
+                if self._cookie_cache:
+                    return
+                if time.monotonic() >= deadline:
+                    raise queue.Empty
+                await asyncio.sleep(0.5)
+
+    def _take_harvested_cookies(self):
+        """Apply every harvest which is ready in the cookie pool, without blocking."""
+        while True:
+            try:
+                harvest = self.cookie_pool.get(block=False)
+            except queue.Empty:
+                return
+            self._apply_cookies(*harvest)
+
+    async def retire_profile(self, profile_id, harvested_at):
+        """
+        Take a profile whose cookies are rejected out of rotation, rotate its proxy and
+        harvest new cookies for it in the background.
+
+        Args:
+            profile_id (str): Profile ID to retire.
+            harvested_at (float): Harvest time of the cookies the rejected request was sent with.
+        """
+        cached = self._cookie_cache.get(profile_id)
+        if cached is None or cached[2] != harvested_at:
+            return  # Already retired by another request, or the cookies were refreshed since
+        del self._cookie_cache[profile_id]
+
+        try:
+            await asyncio.to_thread(self.rotate_proxy, profile_id)
+        except Exception as e:
+            logging.error(f"Failed to rotate the proxy of profile {profile_id}: {e}")
+        finally:
+            # Always harvest again, also if this request is cancelled while rotating,
+            # otherwise the profile would never return to rotation. The rejected cookies
+            # may have come from the plain HTTP harvest, so use the browser.
+            self.cookie_pool.refresh(profile_id, force_browser=True)
+
+    async def next_profile(self):
         """
-        Fetch new cookies and user-agent for the current profile using AdsPowerManager.
+        Get the next profile with usable cookies, waiting for cookies if there is none.
+        Cookies older than COOKIE_TTL are harvested again in the background, the old ones
+        stay in use until the new ones are applied.
+
+        Returns:
+            tuple: Profile ID and harvest time of its cookies.
         """
-        self.rotate_proxy()
-        ads_power_client = AdsPowerManager()
-        self.cookies, self.user_agent = ads_power_client.get_cookies(self.profile_id )
+        # Apply harvests which finished in the meantime
+        self._take_harvested_cookies()
+
+        while True:
+            for _ in range(len(self.sessions)):
+                profile_id = next(self._profile_cycle)
+                cached = self._cookie_cache.get(profile_id)
+                if cached is None:
+                    continue
+                if time.monotonic() - cached[2] >= COOKIE_TTL and profile_id not in self._renewing:
+                    # Harvest new cookies before StubHub starts rejecting the old ones
+                    self._renewing.add(profile_id)
+                    self.cookie_pool.refresh(profile_id)
+                return profile_id, cached[2]
+            await self.refresh_cookies()
+
+    async def close(self):
+        """Close the underlying HTTP sessions and stop harvesting cookies."""
+        for session in self.sessions.values():
+            await session.close()
+        self.cookie_pool.shutdown()
 
     @staticmethod
+    @functools.lru_cache(maxsize=4096)
     def encode_lat_lon_stubhub(coordinates):
         """
-        Encode latitude or longitude as a StubHub-compatible base64 string.
+        Encode latitude or longitude as a StubHub-compatible base64 string. Results are
+        memoized, as the same coordinates are encoded again for repeated locations.
 
         Args:
             coordinates (float): Latitude or longitude value.
@@ -86,16 +279,89 @@ class StubhubScraper:
         Args:
             events_urls (list): List of event URL dictionaries.
         """
-        df = pd.DataFrame(events_urls)
-        df.to_csv("events_urls.csv", encoding="utf-8", index=False)
+        with open("events_urls.csv", "w", newline="", encoding="utf-8") as f:
+            # Same line endings as the pandas export this replaced
+            writer = csv.writer(f, lineterminator=os.linesep)
+            writer.writerow(["Url", "State"])
+            writer.writerows((event["Url"], event["State"]) for event in events_urls)
+
+    async def _fetch_page(self, url, retry_attempts, headers=None, json_data=None):
+        """
+        Fetch a single StubHub page, refreshing cookies and retrying on failure.
 
-    def get_event_urls(self, lat_lng_state_list, retry_attempts=3):
+        Args:
+            url (str): URL to request.
+            retry_attempts (int): Number of retry attempts for failed requests.
+            headers (dict): Request specific headers, sent on top of the session headers.
+            json_data (dict): JSON body. If given the page is requested with POST, otherwise with GET.
+
+        Returns:
+            dict: Parsed JSON response.
+
+        Raises:
+            ScrapeFailed: If the page could not be fetched within the retry attempts.
+        """
+        for attempt in range(1, retry_attempts + 1):
+            profile_id = harvested_at = None
+            cookies_rejected = False
+            try:
+                profile_id, harvested_at = await self.next_profile()
+                session = self.sessions[profile_id]
+                async with self.semaphore:
+                    if json_data is None:
+                        response = await session.get(url, headers=headers)
+                    else:
+                        response = await session.post(url, headers=headers, json=json_data)
+                logging.info(f"Requesting URL: {url}, Profile: {profile_id}, Status Code: {response.status_code}")
+
+                if response.status_code == 200:
+                    try:
+                        return orjson.loads(response.content)  # Parse the response JSON
+                    except orjson.JSONDecodeError:
+                        # StubHub serves a challenge page instead of JSON to unknown sessions
+                        logging.warning(f"Received a challenge page instead of JSON. Retrying attempt {attempt}...")
+                        cookies_rejected = True
+                else:
+                    logging.warning(
+                        f"Request failed with status code {response.status_code}. Retrying attempt {attempt}...")
+
+                    # Only an authorization failure means the cookies have to be harvested again,
+                    # rate limits and server errors are waited out
+                    cookies_rejected = response.status_code in (401, 403)
+            except Exception as e:
+                # Transport errors like proxy timeouts or connection resets are waited out
+                logging.error(f"Attempt {attempt} failed: {e}")
+                logging.debug(traceback.format_exc())  # Log the stack trace for debugging
+
+            if attempt < retry_attempts:
+                if cookies_rejected:
+                    logging.warning("Retrying after refreshing cookies...")
+                    try:
+                        if profile_id:
+                            await self.retire_profile(profile_id, harvested_at)
+                        await self.refresh_cookies()
+                    except Exception as e:
+                        # E.g. queue.Empty if no cookies were harvested in time
+                        logging.critical(f"Failed to refresh cookies: {e}. Request failed for URL: {url}")
+                        raise ScrapeFailed(url) from e
+                    # Spread out the retries of requests which failed at the same time
+                    await asyncio.sleep(random.uniform(0, 1))
+                else:
+                    backoff = 2 ** attempt + random.random()
+                    logging.warning(f"Retrying after {backoff:.1f} seconds...")
+                    await asyncio.sleep(backoff)
+
+        logging.critical(f"Max retry attempts reached. Request failed for URL: {url}")
+        raise ScrapeFailed(url)
+
+    async def get_event_urls(self, lat_lng_state_list, retry_attempts=3, event_queue=None):
         """
         Fetch event URLs from StubHub for the given locations.
 
         Args:
             lat_lng_state_list (list): List of location dictionaries with latitude, longitude, and state.
             retry_attempts (int): Number of retry attempts for failed requests.
+            event_queue (asyncio.Queue): Optional queue every new event URL dictionary is put on.
 
         Returns:
             list: List of event URL dictionaries.
@@ -105,266 +371,284 @@ class StubhubScraper:
         logging.info("Starting to fetch event URLs for given locations.")
 
         for lat_lng_state in lat_lng_state_list:
-            temp_list = []  # Temporary list to track URLs for the current location
+            temp_seen = set()  # Track URLs already seen for the current location
             encoded_lat = self.encode_lat_lon_stubhub(lat_lng_state["latitude"])
             encoded_lon = self.encode_lat_lon_stubhub(lat_lng_state["longitude"])
 
             # Construct the base URL with encoded latitude and longitude
             base_url = "https://www.stubhub.com/explore?method=getExploreEvents"
             url_with_coordinates = f"{base_url}&lat={encoded_lat}&lon={encoded_lon}"
-            page_count = 0
 
             logging.debug(f"Processing location: {lat_lng_state}")
 
-            while True:
-                payload = {}  # Empty payload for GET request
-                headers = {
-                    'accept': '*/*',
-                    'accept-language': 'en-US,en;q=0.9',
-                    'content-type': 'application/json',
-                    'cookies': self.cookies,
-                    'user-agent': self.user_agent
-                }
-
-                # Append the current page number to the URL for pagination
-                url_with_pagination = url_with_coordinates + f"&page={page_count}"
-
-                # Retry mechanism for handling failed requests
-                for attempt in range(1, retry_attempts + 1):
-                    try:
-                        proxies = {
-                            "http": self.proxy,
-                            "https": self.proxy
-                        }
-                        response = requests.get(
-                            url_with_pagination,
-                            headers=headers,
-                            proxies=proxies,
-                            data=payload
-                        )
-                        logging.info(
-                            f"Requesting URL: {url_with_pagination}, Status Code: {response.status_code}, Page Count: {page_count}")
-
-                        if response.status_code != 200:  # Check if response status is not OK
-                            if attempt < retry_attempts:
-                                logging.warning(
-                                    f"Request failed with status code {response.status_code}. Retrying attempt {attempt}...")
-                                self.update_cookies()  # Refresh cookies before retrying
-                                headers["cookies"] = self.cookies
-                                headers['user-agent'] = self.user_agent
-                            else:
-                                logging.error(
-                                    f"Max retry attempts reached. Request failed for URL: {url_with_pagination}")
-                                exit()  # Exit the loop if max retry attempts are reached
-                        break  # Exit the retry loop if request is successful
-                    except Exception as e:
-                        logging.error(f"Attempt {attempt} failed: {e}")
-                        logging.debug(traceback.format_exc())  # Log the stack trace for debugging
-                        if attempt < retry_attempts:
-                            logging.warning("Retrying after refreshing cookies...")
-                            self.update_cookies()
-                            headers["cookies"] = self.cookies
-                            headers['user-agent'] = self.user_agent
-                        else:
-                            logging.critical("Max retry attempts reached. Exiting.")
-                            exit()
-
-                events_data = response.json()  # Parse the response JSON
-                if events_data.get("events"):  # Check if there are events in the response
-                    for event in events_data["events"]:
-                        if event["url"] not in temp_list:  # Avoid duplicate URLs
-                            temp_list.append(event["url"])
-                            event_dict = {
-                                "Url": event["url"],
-                                "State": lat_lng_state["state"]
-                            }
-                            event_urls.append(event_dict)
-
-                            # Stop if we have collected 100 events
-                            if len(event_urls) == 100:
-                                logging.info("Reached 100 events limit. Stopping further requests.")
-                                break
-
-                # Save the event URLs to a JSON file after each page request
-                with open("event_urls.json", "w", encoding="utf-8") as f:
-                    json.dump(event_urls, f, ensure_ascii=False, indent=4)
-                    logging.debug("Event URLs saved to event_urls.json")
-
-                # Stop fetching if 100 events are collected or no remaining events
-                if len(event_urls) == 100:
-                    break
-                if events_data["remaining"] == 0:
+            # Fetch the first page to learn how many pages the location has
+            try:
+                first_page = await self._fetch_page(url_with_coordinates + "&page=0", retry_attempts, headers=self._explore_headers)
+            except ScrapeFailed as e:
+                logging.error(f"Skipping location {lat_lng_state}, failed to fetch: {e}")
+                continue
+
+            page_size = len(first_page.get("events") or [])
+            total_pages = 1
+            if page_size and first_page["remaining"]:
+                total_pages = math.ceil((page_size + first_page["remaining"]) / page_size)
+
+            # Request all remaining pages at once instead of waiting for each page to decide on the next
+            page_tasks = [
+                asyncio.create_task(
+                    self._fetch_page(url_with_coordinates + f"&page={page_count}", retry_attempts, headers=self._explore_headers)
+                )
+                for page_count in range(1, total_pages)
+            ]
+
+            try:
+                # Pages are processed in order, so the collected URLs keep the StubHub ordering
+                for page_count in range(total_pages):
+                    events_data = first_page if page_count == 0 else await page_tasks[page_count - 1]
+                    logging.debug(f"Fetched page {page_count} for location: {lat_lng_state}")
+
+                    if events_data.get("events"):  # Check if there are events in the response
+                        for event in events_data["events"]:
+                            if event["url"] not in temp_seen:  # Avoid duplicate URLs
+                                temp_seen.add(event["url"])
+                                event_dict = {
+                                    "Url": event["url"],
+                                    "State": lat_lng_state["state"]
+                                }
+                                event_urls.append(event_dict)
+                                if event_queue is not None:
+                                    await event_queue.put(event_dict)
+
+                                # Stop if we have collected 100 events
+                                if len(event_urls) == 100:
+                                    logging.info("Reached 100 events limit. Stopping further requests.")
+                                    break
+
+                    # Stop processing pages if 100 events are collected
+                    if len(event_urls) == 100:
+                        break
+                else:
                     logging.info(f"No remaining events for location: {lat_lng_state}")
-                    break
-
-                page_count += 1  # Increment page count for pagination
+            except ScrapeFailed as e:
+                logging.error(f"Skipping rest of location {lat_lng_state}, failed to fetch: {e}")
+            finally:
+                # Cancel the page requests which are not needed anymore
+                for task in page_tasks:
+                    task.cancel()
+                await asyncio.gather(*page_tasks, return_exceptions=True)
+
+            # Stop at once if 100 events are collected, without requesting the next location
+            if len(event_urls) == 100:
+                break
+
+        # Save the event URLs to a JSON file once all locations are processed
+        with open("event_urls.json", "wb") as f:
+            f.write(orjson.dumps(event_urls, option=orjson.OPT_INDENT_2))
+            logging.debug("Event URLs saved to event_urls.json")
 
         logging.info("Completed fetching event URLs.")
         return event_urls
 
-    def get_event_listings(self, event_urls, retry_attempts):
+    async def _get_single_event_listings(self, event_url, retry_attempts):
         """
-        Fetch event listings from StubHub for the given event URLs.
+        Fetch all ticket listing pages of a single event.
 
         Args:
-            event_urls (list): List of event URL dictionaries with state information.
+            event_url (str): URL of the event.
             retry_attempts (int): Number of retry attempts for failed requests.
 
         Returns:
-            defaultdict: Dictionary containing ticket details grouped by state.
+            list: Ticket listings of the event.
         """
-        tickets_details_dict = defaultdict(list)  # Initialize a dictionary to store ticket details
+        event_listing = []  # Initialize a list to store ticket listings for the current event
+        page_count = 1
 
-        logging.info("Starting to fetch event listings for the provided URLs.")
+        # Only the volatile fields are set per event and page
+        headers = self._listing_headers.copy()
+        headers['referer'] = f'{event_url}/?quantity=2'
+        json_data = self._listing_payload.copy()
 
-        for event_obj in event_urls:
-            event_listing = []  # Initialize a list to store ticket listings for the current event
-            event_url = event_obj["Url"]
-            state = event_obj["State"]
-            page_count = 1
+        while True:
+            json_data['CurrentPage'] = page_count
+
+            listing_details = await self._fetch_page(event_url, retry_attempts, headers=headers, json_data=json_data)
+
+            if not listing_details["items"]:  # Break if no more items are found
+                logging.info(f"No more listings found for URL: {event_url}")
+                break
+
+            for ticket in listing_details["items"]:
+                event_listing.append(ticket)
+
+            logging.debug(f"Collected {len(listing_details['items'])} tickets for page {page_count}.")
 
-            logging.debug(f"Processing event URL: {event_url} for state: {state}")
+            page_count += 1  # Increment the page count for the next page
 
+        return event_listing
+
+    async def _process_event(self, event_obj, retry_attempts, tickets_details_dict):
+        """
+        Fetch the listings of a single event and save them.
+
+        Args:
+            event_obj (dict): Event URL dictionary with state information.
+            retry_attempts (int): Number of retry attempts for failed requests.
+            tickets_details_dict (defaultdict): Dictionary collecting ticket details grouped by state.
+        """
+        event_url = event_obj["Url"]
+        state = event_obj["State"]
+
+        logging.debug(f"Processing event URL: {event_url} for state: {state}")
+
+        try:
+            event_listing = await self._get_single_event_listings(event_url, retry_attempts)
+        except ScrapeFailed as e:
+            logging.error(f"Skipping event {event_url}, failed to fetch: {e}")
+            return
+
+        tickets_details_dict[state].append(event_listing)  # Group event listings by state
+
+        # Append the ticket details of the event as a single JSON line, so only the
+        # new records are written instead of the whole accumulated dictionary
+        record = {"Url": event_url, "State": state, "Listings": event_listing}
+        with open("ticket_details.jsonl", "ab") as f:
+            f.write(orjson.dumps(record) + b"\n")
+            logging.debug(f"Ticket details of {event_url} saved to ticket_details.jsonl")
+
+    async def _consume_event_listings(self, event_queue, retry_attempts, workers):
+        """
+        Fetch event listings for the events put on the queue until it is closed.
+
+        Args:
+            event_queue (asyncio.Queue): Queue of event URL dictionaries. Closed by putting
+             one None per worker on it.
+            retry_attempts (int): Number of retry attempts for failed requests.
+            workers (int): Number of events processed at the same time.
+
+        Returns:
+            defaultdict: Dictionary containing ticket details grouped by state.
+        """
+        tickets_details_dict = defaultdict(list)  # Initialize a dictionary to store ticket details
+
+        # Start with an empty file, so records of a previous run are not mixed in
+        open("ticket_details.jsonl", "wb").close()
+
+        async def listing_worker():
             while True:
-                headers = {
-                    'accept': '*/*',
-                    'accept-language': 'en-GB,en-US;q=0.9,en;q=0.8',
-                    'cache-control': 'no-cache',
-                    'content-type': 'application/json',
-                    'cookie': self.cookies,
-                    'origin': 'https://www.stubhub.com',
-                    'pragma': 'no-cache',
-                    'priority': 'u=1, i',
-                    'referer': f'{event_url}/?quantity=2',
-                    'sec-ch-ua': '"Google Chrome";v="131", "Chromium";v="131", "Not_A Brand";v="24"',
-                    'sec-ch-ua-mobile': '?0',
-                    'sec-ch-ua-platform': '"Windows"',
-                    'sec-fetch-dest': 'empty',
-                    'sec-fetch-mode': 'cors',
-                    'sec-fetch-site': 'same-origin',
-                    'user-agent': f'{self.user_agent}',
-                }
-
-                json_data = {
-                    'ShowAllTickets': True,
-                    'HideDuplicateTicketsV2': False,
-                    'Quantity': 2,
-                    'IsInitialQuantityChange': False,
-                    'PageVisitId': '8B9A160A-F8B7-4256-9412-827CB48FD137',
-                    'PageSize': 20,
-                    'CurrentPage': page_count,
-                    'SortBy': 'NEWPRICE',
-                    'SortDirection': 0,
-                    'Sections': '',
-                    'Rows': '',
-                    'Seats': '',
-                    'SeatTypes': '',
-                    'TicketClasses': '',
-                    'ListingNotes': '',
-                    'PriceRange': '0,100',
-                    'InstantDelivery': False,
-                    'EstimatedFees': False,
-                    'BetterValueTickets': True,
-                    'PriceOption': '',
-                    'HasFlexiblePricing': False,
-                    'ExcludeSoldListings': False,
-                    'RemoveObstructedView': False,
-                    'NewListingsOnly': False,
-                    'PriceDropListingsOnly': False,
-                    'SelectBestListing': False,
-                    'ConciergeTickets': False,
-                    'Favorites': False,
-                    'Method': 'IndexSh',
-                }
-
-                # Retry mechanism for handling failed requests
-                for attempt in range(1, retry_attempts + 1):
-                    try:
-                        proxies = {
-                            "http": self.proxy,
-                            "https": self.proxy
-                        }
-                        response = requests.post(
-                            event_url,
-                            headers=headers,
-                            proxies=proxies,
-                            json=json_data
-                        )
-                        logging.info(
-                            f"Requesting URL: {event_url}, Status Code: {response.status_code}, Page Count: {page_count}")
-
-                        if response.status_code != 200:
-                            if attempt < retry_attempts:
-                                logging.warning(
-                                    f"Request failed with status code {response.status_code}. Retrying attempt {attempt}...")
-                                self.update_cookies()  # Refresh cookies before retrying
-                                headers["cookies"] = self.cookies
-                                headers['user-agent'] = self.user_agent
-                            else:
-                                logging.error("Max retry attempts reached. Request failed.")
-                                exit()
-                        break  # Exit the retry loop if request is successful
-                    except Exception as e:
-                        logging.error(f"Attempt {attempt} failed: {e}")
-                        logging.debug(traceback.format_exc())  # Log stack trace for debugging
-                        if attempt < retry_attempts:
-                            logging.warning("Retrying after refreshing cookies...")
-                            self.update_cookies()
-                            headers["cookies"] = self.cookies
-                            headers['user-agent'] = self.user_agent
-                        else:
-                            logging.critical("Max retry attempts reached. Exiting.")
-                            exit()
-
-                listing_details = response.json()  # Parse the response JSON
-
-                if not listing_details["items"]:  # Break if no more items are found
-                    logging.info(f"No more listings found for URL: {event_url}")
+                event_obj = await event_queue.get()
+                if event_obj is None:  # The queue is closed
                     break
+                await self._process_event(event_obj, retry_attempts, tickets_details_dict)
+
+        worker_tasks = [asyncio.create_task(listing_worker()) for _ in range(workers)]
+        try:
+            # Stop at the first failing worker instead of letting the others run on
+            done, _ = await asyncio.wait(worker_tasks, return_when=asyncio.FIRST_EXCEPTION)
+            for task in done:
+                task.result()  # Re-raise the exception of a failed worker
+        finally:
+            # Make sure no worker keeps using the sessions after we return or raise
+            for task in worker_tasks:
+                task.cancel()
+            await asyncio.gather(*worker_tasks, return_exceptions=True)
 
-                for ticket in listing_details["items"]:
-                    event_listing.append(ticket)
+        return tickets_details_dict
+
+    async def get_event_listings(self, event_urls, retry_attempts, workers=CONCURRENT_REQUESTS):
+        """
+        Fetch event listings from StubHub for the given event URLs. Events are fetched
+        concurrently, the number of in-flight requests is bounded by the scraper semaphore.
 
-                logging.debug(f"Collected {len(listing_details['items'])} tickets for page {page_count}.")
+        Args:
+            event_urls (list): List of event URL dictionaries with state information.
+            retry_attempts (int): Number of retry attempts for failed requests.
+            workers (int): Number of events processed at the same time.
 
-                page_count += 1  # Increment the page count for the next page
+        Returns:
+            defaultdict: Dictionary containing ticket details grouped by state.
+        """
+        logging.info("Starting to fetch event listings for the provided URLs.")
 
-            tickets_details_dict[state].append(event_listing)  # Group event listings by state
+        event_queue = asyncio.Queue()
+        for event_obj in event_urls:
+            event_queue.put_nowait(event_obj)
+        for _ in range(workers):
+            event_queue.put_nowait(None)
 
-            # Save the ticket details to a JSON file after processing each event
-            with open("ticket_details.json", "w", encoding="utf-8") as f:
-                json.dump(tickets_details_dict, f, ensure_ascii=False, indent=4)
-                logging.debug("Ticket details saved to ticket_details.json")
+        tickets_details_dict = await self._consume_event_listings(event_queue, retry_attempts, workers)
 
         logging.info("Completed fetching event listings.")
         return tickets_details_dict
 
+    async def scrape(self, lat_lng_state_list, retry_attempts, workers=CONCURRENT_REQUESTS):
+        """
+        Fetch event URLs for the given locations and their listings in a single pipeline.
+        Listings of an event are fetched as soon as its URL is found, instead of after all
+        locations are processed. The event URLs are saved to events_urls.csv once collected.
 
-if __name__ =="__main__":
+        Args:
+            lat_lng_state_list (list): List of location dictionaries with latitude, longitude, and state.
+            retry_attempts (int): Number of retry attempts for failed requests.
+            workers (int): Number of events processed at the same time.
 
+        Returns:
+            tuple: List of event URL dictionaries and dictionary containing ticket details grouped by state.
+        """
+        event_queue = asyncio.Queue()
+        listings_task = asyncio.create_task(self._consume_event_listings(event_queue, retry_attempts, workers))
+
+        urls_task = asyncio.create_task(self.get_event_urls(lat_lng_state_list, retry_attempts, event_queue))
+
+        try:
+            await asyncio.wait([urls_task, listings_task], return_when=asyncio.FIRST_COMPLETED)
+            if not urls_task.done():
+                # The workers only stop early if they failed, stop collecting URLs as well
+                listings_task.result()
+            event_urls = await urls_task
+        except BaseException:
+            # Stop both sides before the caller closes the sessions they are using
+            urls_task.cancel()
+            listings_task.cancel()
+            await asyncio.gather(urls_task, listings_task, return_exceptions=True)
+            raise
+
+        # Close the queue, so the workers stop once the found events are processed
+        for _ in range(workers):
+            event_queue.put_nowait(None)
+
+        # Save the event URLs right away, so they are kept if fetching the listings fails
+        logging.info("Saving fetched event URLs to a file.")
+        self.save_events_urls(event_urls)
+
+        tickets_details_dict = await listings_task
+
+        logging.info("Completed fetching event listings.")
+        return event_urls, tickets_details_dict
+
+
+async def main():
     # Initialize scraper client
     scraper_client = StubhubScraper()
 
-    # Update scraper client with a random profile and cookies
-    logging.info("Initializing scraper client with a random profile and updating cookies.")
-    scraper_client.update_with_random_profile()
-    scraper_client.update_cookies()
+    try:
+        # Wait for the cookies of the first profile
+        logging.info("Initializing scraper client and waiting for cookies.")
+        await scraper_client.refresh_cookies()
 
-    # Load geo-location data from JSON file
-    logging.info("Loading geo-location data from us-cities.json.")
-    with open("us-cities.json", "r", encoding="utf-8") as f:
-        geo_locations = json.load(f)
+        # Load geo-location data from JSON file
+        logging.info("Loading geo-location data from us-cities.json.")
+        with open("us-cities.json", "rb") as f:
+            geo_locations = orjson.loads(f.read())
 
-    # Get event URLs using the provided geo-locations
-    logging.info("Fetching event URLs based on geo-locations.")
-    all_event_urls = scraper_client.get_event_urls(geo_locations, RETRY_ATTEMPTS)
+        # Get event URLs using the provided geo-locations and fetch their listings as they are found.
+        # The event URLs are saved to a file as soon as they are all collected.
+        logging.info("Fetching event URLs and their listings based on geo-locations.")
+        await scraper_client.scrape(geo_locations, RETRY_ATTEMPTS)
 
-    # Save the fetched event URLs to a file
-    logging.info("Saving fetched event URLs to a file.")
-    scraper_client.save_events_urls(all_event_urls)
+        logging.info("Completed fetching all event listings.")
+    finally:
+        await scraper_client.close()
 
-    # Fetch event listings for the saved event URLs
-    logging.info("Starting to fetch event listings for all saved URLs.")
-    scraper_client.get_event_listings(all_event_urls, RETRY_ATTEMPTS)
 
-    logging.info("Completed fetching all event listings.")
+if __name__ =="__main__":
+    asyncio.run(main())
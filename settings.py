@@ -2,10 +2,27 @@
 # This is the local instance of the AdsPower service running on a specific port
 ADSPOWER_BASE_URL = "http://local.adspower.com:50325"
 
+# Start AdsPower browsers without a window
+# Headless browsers start faster when they are only used to harvest cookies
+ADSPOWER_HEADLESS = True
+
+# User agent sent when cookies are requested without a browser
+# Matches the Chrome version announced in the StubHub request headers
+DEFAULT_USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/131.0.0.0 Safari/537.36"
+
 # Number of retry attempts for failed operations
 # In case of failure, the system will retry the specified number of times before giving up
 RETRY_ATTEMPTS = 3
 
+# Maximum number of concurrent requests sent to StubHub
+# Keeps the scraper polite while many pages are fetched at the same time
+CONCURRENT_REQUESTS = 20
+
+# Number of seconds after which cookies are harvested again in the background
+# The old cookies stay in use until the new ones arrive, cookies rejected by StubHub
+# (401/403) are harvested again right away
+COOKIE_TTL = 300
+
 # Dictionary mapping profile identifiers to proxies
 # Each profile is associated with a proxy and a URL for rotating it
 PROFILES_TO_PROXIES = {